@@ -1,5 +1,5 @@
 import sqlite3
-from werkzeug.security import generate_password_hash
+from argon2 import PasswordHasher
 
 conn = sqlite3.connect('timetable.db')
 cursor = conn.cursor()
@@ -10,7 +10,7 @@ cursor.execute('''
 ''', (
     'Main Admin',
     'srmtt@srmist.edu.in',
-    generate_password_hash('mcs2024'),
+    PasswordHasher().hash('mcs2024'),
     'main_admin'
 ))
 
@@ -6,6 +6,7 @@ from typing import Dict, List, Tuple
 import requests
 import os
 from datetime import datetime
+from users import USER_SUBJECTS_SQL
 
 class TimetableGenerator:
     def __init__(self):
@@ -30,10 +31,10 @@ class TimetableGenerator:
             
             # Get staff and their subjects
             cursor.execute('''
-                SELECT u.id, u.name, u.staff_role, u.subjects_selected
+                SELECT u.id, u.name, u.staff_role, {} as subjects_selected
                 FROM users u
                 WHERE u.department_id = ? AND u.role = 'staff' AND u.subjects_locked = 1
-            ''', (department_id,))
+            '''.format(USER_SUBJECTS_SQL), (department_id,))
             staff_data = cursor.fetchall()
             
             # Get subjects
@@ -54,8 +55,8 @@ class TimetableGenerator:
             # Process data
             staff_subjects = {}
             for staff in staff_data:
-                if staff[3]:  # subjects_selected
-                    subject_ids = [int(s) for s in staff[3].split(',')]
+                subject_ids = [int(s) for s in json.loads(staff[3])]  # subjects_selected
+                if subject_ids:
                     staff_subjects[staff[0]] = {
                         'name': staff[1],
                         'role': staff[2],
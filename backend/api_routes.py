@@ -1,7 +1,9 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import sqlite3
+import json
 from ai_timetable import TimetableGenerator
+from users import USER_SUBJECTS_SQL
 import os
 
 api = Blueprint('api', __name__)
@@ -26,11 +28,13 @@ def get_staff():
         
         # Get staff in the same department
         cursor.execute('''
-            SELECT u.id, u.name, u.email, u.staff_role, u.subjects_selected, u.subjects_locked
+            SELECT u.id, u.name, u.email, u.staff_role,
+                   {} as subjects_selected,
+                   u.subjects_locked
             FROM users u
             WHERE u.department_id = ? AND u.role = 'staff'
             ORDER BY u.name
-        ''', (department_id,))
+        '''.format(USER_SUBJECTS_SQL), (department_id,))
         
         staff_data = cursor.fetchall()
         conn.close()
@@ -42,7 +46,7 @@ def get_staff():
                 'name': staff[1],
                 'email': staff[2],
                 'staff_role': staff[3],
-                'subjects_selected': staff[4].split(',') if staff[4] else [],
+                'subjects_selected': json.loads(staff[4]),
                 'subjects_locked': bool(staff[5])
             })
         
@@ -144,6 +148,11 @@ def select_subjects():
         if not data.get('subject_ids'):
             return jsonify({'error': 'Subject IDs are required'}), 400
         
+        try:
+            subject_ids = [int(subject_id) for subject_id in data['subject_ids']]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Subject IDs must be integers'}), 400
+        
         conn = sqlite3.connect('timetable.db')
         cursor = conn.cursor()
         
@@ -160,16 +169,16 @@ def select_subjects():
         staff_role = user_data[0]
         max_subjects = 2 if staff_role == 'assistant_professor' else 1
         
-        if len(data['subject_ids']) > max_subjects:
+        if len(subject_ids) > max_subjects:
             return jsonify({'error': f'Maximum {max_subjects} subjects allowed for {staff_role}'}), 400
         
         # Update user's subjects
-        subjects_str = ','.join(map(str, data['subject_ids']))
-        cursor.execute('''
-            UPDATE users 
-            SET subjects_selected = ?, subjects_locked = 1
-            WHERE id = ?
-        ''', (subjects_str, current_user_id))
+        cursor.execute('DELETE FROM user_subjects WHERE user_id = ?', (current_user_id,))
+        cursor.executemany('''
+            INSERT OR IGNORE INTO user_subjects (user_id, subject_id)
+            VALUES (?, ?)
+        ''', [(current_user_id, subject_id) for subject_id in subject_ids])
+        cursor.execute('UPDATE users SET subjects_locked = 1 WHERE id = ?', (current_user_id,))
         
         conn.commit()
         conn.close()
@@ -1,13 +1,22 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
+from werkzeug.exceptions import HTTPException
 from werkzeug.security import generate_password_hash, check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 import sqlite3
+import hmac
+import orjson
+import re
 from datetime import timedelta
 import os
 from dotenv import load_dotenv
 from api_routes import api
+from db import PoolExhaustedError, configure_connection, get_db, init_app as init_db_pool
 from ai_timetable import TimetableGenerator
+from cache import password_check_cache, timetable_stats_cache
+from users import LOGIN_SQL, LOGIN_SQL_MIN, VERIFY_SQL, user_from_row
 
 # Load environment variables
 load_dotenv()
@@ -18,253 +27,349 @@ app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-secret-key-chan
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 
 jwt = JWTManager(app)
+
+# HS256 key encoded once so token signing and verification skip the
+# per-call config lookup and str -> bytes conversion. The loaders below
+# replace flask_jwt_extended's key lookup, so JWT_SECRET_KEY is read only
+# here and asymmetric algorithms (JWT_PRIVATE_KEY/JWT_PUBLIC_KEY) are
+# not supported
+if not app.config['JWT_ALGORITHM'].startswith('HS'):
+    raise RuntimeError(f"JWT_ALGORITHM {app.config['JWT_ALGORITHM']} is not supported; "
+                       'the cached signing key only works with HS256/HS384/HS512')
+JWT_KEY_BYTES = app.config['JWT_SECRET_KEY'].encode()
+
+@jwt.encode_key_loader
+def jwt_encode_key(identity):
+    return JWT_KEY_BYTES
+
+@jwt.decode_key_loader
+def jwt_decode_key(jwt_header, jwt_data):
+    return JWT_KEY_BYTES
+
 CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
 
+# JSON responses serialized with orjson instead of the stdlib json encoder
+def ojsonify(obj) -> Response:
+    return Response(orjson.dumps(obj), mimetype='application/json')
+
 # Register Blueprints
 app.register_blueprint(api)
 
+# Pooled SQLite connections are returned on app context teardown
+init_db_pool(app)
+
+# Login payload limits, checked before touching the database
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+MAX_EMAIL_LENGTH = 254
+MAX_PASSWORD_LENGTH = 256
+
+# Bump whenever SCHEMA changes so existing databases re-run it
+SCHEMA_VERSION = 1
+
+# Database schema, applied as a single script in one transaction
+SCHEMA = '''
+    BEGIN;
+
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL CHECK (role IN ('main_admin', 'dept_admin', 'staff')),
+        department_id INTEGER,
+        staff_role TEXT CHECK (staff_role IN ('assistant_professor', 'professor', 'hod')),
+        subjects_selected TEXT,
+        subjects_locked BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (department_id) REFERENCES departments (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS departments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        code TEXT UNIQUE NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS subjects (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        code TEXT NOT NULL,
+        department_id INTEGER NOT NULL,
+        credits INTEGER DEFAULT 3,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (department_id) REFERENCES departments (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS classrooms (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        capacity INTEGER NOT NULL,
+        department_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (department_id) REFERENCES departments (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS timetables (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        department_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        time_slot TEXT NOT NULL,
+        subject_id INTEGER NOT NULL,
+        staff_id INTEGER NOT NULL,
+        classroom_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (department_id) REFERENCES departments (id),
+        FOREIGN KEY (subject_id) REFERENCES subjects (id),
+        FOREIGN KEY (staff_id) REFERENCES users (id),
+        FOREIGN KEY (classroom_id) REFERENCES classrooms (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS constraints (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        department_id INTEGER,
+        role TEXT NOT NULL CHECK (role IN ('assistant_professor', 'professor', 'hod')),
+        subject_type TEXT NOT NULL CHECK (subject_type IN ('theory', 'lab', 'both')),
+        max_subjects INTEGER NOT NULL DEFAULT 1,
+        max_hours INTEGER NOT NULL DEFAULT 8,
+        created_by INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (department_id) REFERENCES departments (id),
+        FOREIGN KEY (created_by) REFERENCES users (id)
+    );
+
+    CREATE TABLE IF NOT EXISTS user_subjects (
+        user_id INTEGER NOT NULL,
+        subject_id INTEGER NOT NULL,
+        PRIMARY KEY (user_id, subject_id),
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (subject_id) REFERENCES subjects (id)
+    );
+
+    -- Indexes for the foreign key columns used in joins and department filters
+    CREATE INDEX IF NOT EXISTS idx_users_dept ON users (department_id);
+    CREATE INDEX IF NOT EXISTS idx_timetables_dept ON timetables (department_id);
+    CREATE INDEX IF NOT EXISTS idx_timetables_subject ON timetables (subject_id);
+    CREATE INDEX IF NOT EXISTS idx_timetables_staff ON timetables (staff_id);
+    CREATE INDEX IF NOT EXISTS idx_timetables_classroom ON timetables (classroom_id);
+    CREATE INDEX IF NOT EXISTS idx_subjects_dept ON subjects (department_id);
+    CREATE INDEX IF NOT EXISTS idx_classrooms_dept ON classrooms (department_id);
+    CREATE INDEX IF NOT EXISTS idx_user_subjects_subject ON user_subjects (subject_id, user_id);
+
+    -- Move subjects still stored in the legacy users.subjects_selected CSV
+    -- column into user_subjects for users that have no rows there yet.
+    -- IDs of deleted subjects and non-numeric tokens are dropped, since
+    -- INSERT OR IGNORE does not suppress foreign key violations
+    WITH RECURSIVE split(user_id, subject_id, rest) AS (
+        SELECT id, NULL, subjects_selected || ','
+        FROM users
+        WHERE subjects_selected IS NOT NULL AND subjects_selected != ''
+          AND NOT EXISTS (SELECT 1 FROM user_subjects us WHERE us.user_id = users.id)
+        UNION ALL
+        SELECT user_id, CAST(substr(rest, 1, instr(rest, ',') - 1) AS INTEGER),
+               substr(rest, instr(rest, ',') + 1)
+        FROM split
+        WHERE rest != ''
+    )
+    INSERT OR IGNORE INTO user_subjects (user_id, subject_id)
+    SELECT user_id, subject_id FROM split
+    WHERE subject_id IN (SELECT id FROM subjects);
+
+    PRAGMA user_version = {version};
+
+    COMMIT;
+'''
+
+# Route queries
+USERS_SQL = '''
+    SELECT u.id, u.name, u.email, u.role, d.name as department_name
+    FROM users u
+    LEFT JOIN departments d ON u.department_id = d.id
+    ORDER BY u.name
+'''
+
+STATS_SQL = 'SELECT COUNT(*) FROM timetables'
+
 # Database initialization
 def init_db():
-    conn = sqlite3.connect('timetable.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT NOT NULL CHECK (role IN ('main_admin', 'dept_admin', 'staff')),
-            department_id INTEGER,
-            staff_role TEXT CHECK (staff_role IN ('assistant_professor', 'professor', 'hod')),
-            subjects_selected TEXT,
-            subjects_locked BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (department_id) REFERENCES departments (id)
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS departments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            code TEXT UNIQUE NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS subjects (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            code TEXT NOT NULL,
-            department_id INTEGER NOT NULL,
-            credits INTEGER DEFAULT 3,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (department_id) REFERENCES departments (id)
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS classrooms (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            capacity INTEGER NOT NULL,
-            department_id INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (department_id) REFERENCES departments (id)
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS timetables (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            department_id INTEGER NOT NULL,
-            day TEXT NOT NULL,
-            time_slot TEXT NOT NULL,
-            subject_id INTEGER NOT NULL,
-            staff_id INTEGER NOT NULL,
-            classroom_id INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (department_id) REFERENCES departments (id),
-            FOREIGN KEY (subject_id) REFERENCES subjects (id),
-            FOREIGN KEY (staff_id) REFERENCES users (id),
-            FOREIGN KEY (classroom_id) REFERENCES classrooms (id)
-        )
-    ''')
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS constraints (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            department_id INTEGER,
-            role TEXT NOT NULL CHECK (role IN ('assistant_professor', 'professor', 'hod')),
-            subject_type TEXT NOT NULL CHECK (subject_type IN ('theory', 'lab', 'both')),
-            max_subjects INTEGER NOT NULL DEFAULT 1,
-            max_hours INTEGER NOT NULL DEFAULT 8,
-            created_by INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (department_id) REFERENCES departments (id),
-            FOREIGN KEY (created_by) REFERENCES users (id)
-        )
-    ''')
-
-    conn.commit()
+    conn = configure_connection(sqlite3.connect('timetable.db'))
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version > SCHEMA_VERSION:
+        # Written by a newer build; never rewind it with an older schema
+        conn.close()
+        raise RuntimeError(f'Database schema version {version} is newer than '
+                           f'this build supports ({SCHEMA_VERSION})')
+    if version < SCHEMA_VERSION:
+        conn.executescript(SCHEMA.format(version=SCHEMA_VERSION))
     conn.close()
 
+# Password verification; new hashes use argon2, legacy werkzeug hashes are
+# still accepted and upgraded on the next successful login
+password_hasher = PasswordHasher()
+
+# Per-process secret for password cache keys, so cached entries are not an
+# offline guessing oracle for anyone who can read process memory
+_CACHE_KEY = os.urandom(32)
+
+def verify_password(email: str, password_hash: str, password: str) -> bool:
+    """Check a password, serving recent successful checks from memory"""
+    key = hmac.new(_CACHE_KEY, '\0'.join((email, password_hash, password)).encode(), 'sha256').digest()
+    if password_check_cache.get(key):
+        return True
+    if password_hash.startswith('$argon2'):
+        try:
+            password_hasher.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+    elif not check_password_hash(password_hash, password):
+        return False
+    password_check_cache.set(key, True)
+    return True
+
+def password_needs_rehash(password_hash: str) -> bool:
+    return not password_hash.startswith('$argon2') or password_hasher.check_needs_rehash(password_hash)
+
 # Health check route
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'message': 'SRM Timetable AI Backend is running'}), 200
+    return ojsonify({'status': 'healthy', 'message': 'SRM Timetable AI Backend is running'}), 200
+
+# Error handlers
+@app.errorhandler(sqlite3.Error)
+def handle_database_error(e):
+    app.logger.exception('Database error')
+    return ojsonify({'success': False, 'error': 'Database error'}), 500
+
+@app.errorhandler(PoolExhaustedError)
+def handle_pool_exhausted(e):
+    # Every pooled connection is busy; a transient overload the client can retry
+    response = ojsonify({'success': False, 'error': 'Server busy, please retry', 'retryable': True})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@app.errorhandler(Exception)
+def handle_unexpected_error(e):
+    if isinstance(e, HTTPException):
+        return e
+    app.logger.exception('Unhandled error')
+    return ojsonify({'success': False, 'error': 'Internal server error'}), 500
 
 # Authentication routes
 @app.route('/api/auth/login', methods=['POST'])
 def login():
-    try:
-        data = request.get_json()
-        email = data.get('email', '').strip().lower()
-        password = data.get('password', '')
-        
-        if not email or not password:
-            return jsonify({'success': False, 'error': 'Email and password are required'}), 400
-        
-        conn = sqlite3.connect('timetable.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT u.id, u.name, u.email, u.password_hash, u.role, u.department_id, 
-                   u.staff_role, u.subjects_selected, u.subjects_locked, d.name as department_name
-            FROM users u
-            LEFT JOIN departments d ON u.department_id = d.id
-            WHERE u.email = ?
-        ''', (email,))
-        
-        user_data = cursor.fetchone()
-        conn.close()
-        
-        if not user_data or not check_password_hash(user_data[3], password):
-            return jsonify({'success': False, 'error': 'Invalid email or password'}), 401
-        
-        user = {
-            'id': str(user_data[0]),
-            'name': user_data[1],
-            'email': user_data[2],
-            'role': user_data[4],
-            'department_id': str(user_data[5]) if user_data[5] else None,
-            'staff_role': user_data[6],
-            'subjects_selected': user_data[7].split(',') if user_data[7] else [],
-            'subjects_locked': bool(user_data[8]),
-            'department_name': user_data[9]
-        }
-        
-        access_token = create_access_token(identity=str(user_data[0]))
-        
-        return jsonify({
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    email = data.get('email')
+    password = data.get('password')
+    
+    if not isinstance(email, str) or not isinstance(password, str):
+        return ojsonify({'success': False, 'error': 'Email and password are required'}), 400
+    
+    email = email.strip().lower()
+    
+    if not email or not password:
+        return ojsonify({'success': False, 'error': 'Email and password are required'}), 400
+    
+    if (len(email) > MAX_EMAIL_LENGTH or len(password) > MAX_PASSWORD_LENGTH
+            or not EMAIL_RE.match(email)):
+        return ojsonify({'success': False, 'error': 'Invalid email or password'}), 400
+    
+    # ?minimal=1 skips the department join and returns only token, id and role
+    minimal = request.args.get('minimal') in ('1', 'true')
+    
+    cursor = get_db().cursor()
+    
+    cursor.execute(LOGIN_SQL_MIN if minimal else LOGIN_SQL, (email,))
+    
+    user_data = cursor.fetchone()
+    
+    if not user_data or not verify_password(email, user_data['password_hash'], password):
+        return ojsonify({'success': False, 'error': 'Invalid email or password'}), 401
+    
+    if password_needs_rehash(user_data['password_hash']):
+        cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?',
+                       (password_hasher.hash(password), user_data['id']))
+        get_db().commit()
+    
+    access_token = create_access_token(identity=str(user_data['id']))
+    
+    if minimal:
+        return ojsonify({
             'success': True,
             'data': {
-                'user': user,
-                'token': access_token
+                'token': access_token,
+                'id': str(user_data['id']),
+                'role': user_data['role']
             }
         }), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': 'Login failed'}), 500
+    
+    user = user_from_row(user_data)
+    
+    return ojsonify({
+        'success': True,
+        'data': {
+            'user': user,
+            'token': access_token
+        }
+    }), 200
 
 @app.route('/api/auth/verify', methods=['GET'])
 @jwt_required()
 def verify_token():
-    try:
-        current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT u.id, u.name, u.email, u.role, u.department_id, 
-                   u.staff_role, u.subjects_selected, u.subjects_locked, d.name as department_name
-            FROM users u
-            LEFT JOIN departments d ON u.department_id = d.id
-            WHERE u.id = ?
-        ''', (current_user_id,))
-        
-        user_data = cursor.fetchone()
-        conn.close()
-        
-        if not user_data:
-            return jsonify({'success': False, 'error': 'User not found'}), 404
-        
-        user = {
-            'id': str(user_data[0]),
-            'name': user_data[1],
-            'email': user_data[2],
-            'role': user_data[3],
-            'department_id': str(user_data[4]) if user_data[4] else None,
-            'staff_role': user_data[5],
-            'subjects_selected': user_data[6].split(',') if user_data[6] else [],
-            'subjects_locked': bool(user_data[7]),
-            'department_name': user_data[8]
-        }
-        
-        return jsonify({'success': True, 'data': {'user': user}}), 200
-        
-    except Exception as e:
-        return jsonify({'success': False, 'error': 'Token verification failed'}), 401
+    current_user_id = get_jwt_identity()
+    cursor = get_db().cursor()
+    
+    cursor.execute(VERIFY_SQL, (current_user_id,))
+    
+    user_data = cursor.fetchone()
+    
+    if not user_data:
+        return ojsonify({'success': False, 'error': 'User not found'}), 404
+    
+    user = user_from_row(user_data)
+    
+    return ojsonify({'success': True, 'data': {'user': user}}), 200
 
 @app.route('/api/auth/logout', methods=['POST'])
 @jwt_required()
 def logout():
-    return jsonify({'success': True, 'message': 'Logged out successfully'}), 200
+    return ojsonify({'success': True, 'message': 'Logged out successfully'}), 200
 
 # Users management
 @app.route('/api/users', methods=['GET'])
 @jwt_required()
 def get_users():
-    try:
-        conn = sqlite3.connect('timetable.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT u.id, u.name, u.email, u.role, d.name as department_name
-            FROM users u
-            LEFT JOIN departments d ON u.department_id = d.id
-            ORDER BY u.name
-        ''')
-        
-        users_data = cursor.fetchall()
-        conn.close()
-        
-        users_list = []
-        for user in users_data:
-            users_list.append({
-                'id': str(user[0]),
-                'name': user[1],
-                'email': user[2],
-                'role': user[3],
-                'department_name': user[4]
-            })
-        
-        return jsonify(users_list), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    cursor = get_db().cursor()
+    
+    cursor.execute(USERS_SQL)
+    
+    users_list = [{
+        'id': str(user['id']),
+        'name': user['name'],
+        'email': user['email'],
+        'role': user['role'],
+        'department_name': user['department_name']
+    } for user in cursor]
+    
+    return ojsonify(users_list), 200
 
 # Timetable stats
 @app.route('/api/timetables/stats', methods=['GET'])
 @jwt_required()
 def get_timetable_stats():
-    try:
-        conn = sqlite3.connect('timetable.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT COUNT(*) FROM timetables')
+    total = timetable_stats_cache.get('total')
+    if total is None:
+        cursor = get_db().cursor()
+        cursor.execute(STATS_SQL)
         total = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        return jsonify({'total': total}), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        timetable_stats_cache.set('total', total)
+    
+    return ojsonify({'total': total}), 200
 
 # Run the application
 if __name__ == '__main__':
     init_db()
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # Werkzeug dev server for local work only; gunicorn (gunicorn_conf.py)
+    # imports app:app and never runs this block
+    app.run(debug=os.getenv('FLASK_DEBUG', '1') == '1', port=5000)
\ No newline at end of file
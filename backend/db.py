@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import queue
+import threading
+from flask import g
+
+DATABASE = 'timetable.db'
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 8))
+# Seconds a request waits for a free connection before failing
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+
+# Applied to every connection: WAL lets readers run alongside writers and
+# synchronous=NORMAL drops the per-commit fsync of the rollback journal
+PRAGMAS = '''
+    PRAGMA journal_mode = WAL;
+    PRAGMA synchronous = NORMAL;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA mmap_size = 268435456;
+    PRAGMA cache_size = -64000;
+    PRAGMA foreign_keys = ON;
+'''
+
+def configure_connection(conn: sqlite3.Connection) -> sqlite3.Connection:
+    conn.executescript(PRAGMAS)
+    return conn
+
+class PoolExhaustedError(Exception):
+    """No pooled connection became free within POOL_TIMEOUT"""
+
+class SQLiteConnectionPool:
+    def __init__(self, database: str, size: int):
+        self.database = database
+        self.size = size
+        self._connections = queue.Queue(maxsize=size)
+        for _ in range(size):
+            self._connections.put(self._connect())
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a long-lived connection that may be handed to any worker thread"""
+        conn = sqlite3.connect(self.database, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        return configure_connection(conn)
+
+    def get(self) -> sqlite3.Connection:
+        try:
+            return self._connections.get(timeout=POOL_TIMEOUT)
+        except queue.Empty:
+            raise PoolExhaustedError('No database connection available')
+
+    def put(self, conn: sqlite3.Connection):
+        # Never hand an open transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        self._connections.put(conn)
+
+pool = None
+_pool_lock = threading.Lock()
+
+def init_pool(database: str = DATABASE, size: int = POOL_SIZE):
+    global pool
+    with _pool_lock:
+        pool = SQLiteConnectionPool(database, size)
+    return pool
+
+def _get_pool() -> SQLiteConnectionPool:
+    global pool
+    if pool is None:
+        with _pool_lock:
+            if pool is None:
+                pool = SQLiteConnectionPool(DATABASE, POOL_SIZE)
+    return pool
+
+def get_db() -> sqlite3.Connection:
+    """Return the pooled connection bound to the current app context"""
+    if '_db' not in g:
+        conn_pool = _get_pool()
+        # Remember the owning pool so the connection goes back to it even
+        # if the global pool is replaced mid-request
+        g._db = (conn_pool, conn_pool.get())
+    return g._db[1]
+
+def close_db(exception=None):
+    entry = g.pop('_db', None)
+    if entry is not None:
+        conn_pool, conn = entry
+        conn_pool.put(conn)
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
@@ -0,0 +1,22 @@
+import os
+import multiprocessing
+
+# Production server: gunicorn -c gunicorn_conf.py app:app
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', 2 * multiprocessing.cpu_count() + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Import the app once in the master so init_db() runs a single time
+preload_app = True
+
+def on_starting(server):
+    from app import init_db
+    init_db()
+
+def post_fork(server, worker):
+    # SQLite connections must not cross fork(), so the master never opens
+    # pooled connections (init_db() closes its own) and every worker builds
+    # its DB_POOL_SIZE pool here, after forking
+    from db import init_pool
+    init_pool()
@@ -1,9 +1,10 @@
 import sqlite3
-from werkzeug.security import generate_password_hash
+from argon2 import PasswordHasher
 
 def seed_database():
     conn = sqlite3.connect('timetable.db')
     cursor = conn.cursor()
+    password_hasher = PasswordHasher()
 
     # Insert Departments
     departments = [
@@ -64,11 +65,15 @@ def seed_database():
     for name, email, password, role, dept_id, staff_role, subj_sel, subj_locked in users:
         cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
         if not cursor.fetchone():
-            hashed = generate_password_hash(password)
+            hashed = password_hasher.hash(password)
             cursor.execute('''
-                INSERT INTO users (name, email, password_hash, role, department_id, staff_role, subjects_selected, subjects_locked)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (name, email, hashed, role, dept_id, staff_role, subj_sel, subj_locked))
+                INSERT INTO users (name, email, password_hash, role, department_id, staff_role, subjects_locked)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (name, email, hashed, role, dept_id, staff_role, subj_locked))
+            if subj_sel:
+                user_id = cursor.lastrowid
+                cursor.executemany('INSERT OR IGNORE INTO user_subjects (user_id, subject_id) VALUES (?, ?)',
+                                   [(user_id, int(subject_id)) for subject_id in subj_sel.split(',')])
 
     conn.commit()
     conn.close()
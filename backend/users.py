@@ -0,0 +1,50 @@
+import json
+
+# Correlated subquery giving the subject IDs of the outer `users u` row as a
+# JSON array of strings, in the order the user selected them
+USER_SUBJECTS_SQL = '''(
+    SELECT json_group_array(CAST(subject_id AS TEXT))
+    FROM (SELECT us.subject_id FROM user_subjects us
+          WHERE us.user_id = u.id ORDER BY us.rowid)
+)'''
+
+# User lookups share one SELECT and differ only in the WHERE clause
+_SELECT_USER = '''
+    SELECT u.id, u.name, u.email, u.password_hash, u.role, u.department_id,
+           u.staff_role, u.subjects_locked, d.name as department_name,
+           {subjects} as subjects_selected
+    FROM users u
+    LEFT JOIN departments d ON u.department_id = d.id
+    WHERE {{where}}
+'''.format(subjects=USER_SUBJECTS_SQL)
+
+LOGIN_SQL = _SELECT_USER.format(where='u.email = ?')
+
+LOGIN_SQL_MIN = 'SELECT id, password_hash, role FROM users WHERE email = ?'
+
+VERIFY_SQL = _SELECT_USER.format(where='u.id = ?')
+
+USERS_BY_IDS_SQL = _SELECT_USER.format(where='u.id IN ({})')
+
+def user_from_row(row) -> dict:
+    return {
+        'id': str(row['id']),
+        'name': row['name'],
+        'email': row['email'],
+        'role': row['role'],
+        'department_id': str(row['department_id']) if row['department_id'] else None,
+        'staff_role': row['staff_role'],
+        'subjects_selected': json.loads(row['subjects_selected']),
+        'subjects_locked': bool(row['subjects_locked']),
+        'department_name': row['department_name']
+    }
+
+def fetch_users_by_ids(conn, ids) -> dict:
+    """Fetch many users in one round-trip, keyed by string id"""
+    # Ids are bound as given, like VERIFY_SQL; unknown ids are simply absent
+    ids = list(ids)
+    if not ids:
+        return {}
+    placeholders = ','.join('?' * len(ids))
+    cursor = conn.execute(USERS_BY_IDS_SQL.format(placeholders), ids)
+    return {str(row['id']): user_from_row(row) for row in cursor}